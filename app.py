@@ -1,12 +1,25 @@
 import streamlit as st
 import openai
 import anthropic
-import pandas as pd
-import re
+import backoff
+import hashlib
 import json
 import logging
-from stqdm import stqdm
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import asyncio
+import contextvars
+import io
+import os
+import sqlite3
+import threading
+import time
+import numpy as np
+from pydantic import BaseModel, Field
+from reportlab.lib.pagesizes import letter
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.lib.enums import TA_CENTER
+from reportlab.lib.colors import HexColor
+from idea_parsing import parse_idea_summaries
 
 Opus = "claude-3-opus-20240229"
 Sonnet = "claude-3-sonnet-20240229"
@@ -14,9 +27,47 @@ Haiku = "claude-3-haiku-20240307"
 
 # Set up API keys and models
 OPENAI_API_KEY = st.secrets["OPENAI_API_KEY"]
-openai = openai.Client(api_key=OPENAI_API_KEY)
+
+@st.cache_resource
+def get_openai_client(api_key: str) -> openai.Client:
+    return openai.Client(api_key=api_key)
+
+openai_client = get_openai_client(OPENAI_API_KEY)
 #ANTHROPIC_API_KEY = st.secrets["ANTHROPIC_API_KEY"]
 gpt_model = "ft:gpt-3.5-turbo-0125:personal:idea-generator:9DgQ5nsD"
+embedding_model = "text-embedding-3-small"
+
+# Limits for concurrent LLM requests
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "20"))
+LLM_TOKENS_PER_MINUTE = int(os.getenv("LLM_TOKENS_PER_MINUTE", "40000"))
+
+# Semantic cache of Claude responses, reused for near-duplicate prompts
+SEMANTIC_CACHE_PATH = os.getenv("SEMANTIC_CACHE_PATH", "llm_cache.sqlite3")
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92"))
+SEMANTIC_CACHE_CANDIDATES = 32
+
+# Number of brainstormed ideas summarized per Claude request
+IDEA_BATCH_SIZE = 5
+
+# Minimum seconds between redraws of a streaming preview
+PREVIEW_INTERVAL = 0.3
+
+class Brief(BaseModel):
+    """
+    An idea brief, as emitted by Claude through BRIEF_TOOL.
+    """
+    title: str = Field(description="Enhanced title for the idea")
+    description: str = Field(description="Detailed description of the idea, including the lede, newsworthy hooks, target audience, and why they should care")
+    justification: str = Field(description="Justification for selecting this idea")
+    methodology: str = Field(description="Methodology for producing this idea, including feasibility within a 2-week timeline")
+    datasets_sources: str = Field(description="Datasets, sources, technologies, and tools needed to accomplish this idea")
+
+# Tool Claude is forced to call so idea briefs come back as structured input
+BRIEF_TOOL = {
+    "name": "emit_brief",
+    "description": "Record the enhanced brief for a story idea.",
+    "input_schema": Brief.model_json_schema(),
+}
 
 
 
@@ -139,7 +190,7 @@ def get_ideas(topic: str, num_ideas: int, temperature: float, model: str) -> lis
     """
     num_ideas_mult = (num_ideas*10)
     try:
-        response = openai.chat.completions.create(
+        response = openai_client.chat.completions.create(
             model=model,
             messages=[
                 {"role": "system", "content": "Generate the most newsworthy possible idea for the given topic. Start your answer with Title:"},
@@ -157,42 +208,359 @@ def get_ideas(topic: str, num_ideas: int, temperature: float, model: str) -> lis
         st.error(f"Error: {str(e)}")
         raise
 
-@st.cache_data
-def evaluate_ideas(generated_ideas: list, num_ideas: int, model: str) -> list:
+def dedupe_ideas(ideas: list) -> list:
+    """
+    Drop ideas that repeat an earlier idea, ignoring case and whitespace.
+
+    Args:
+        ideas (list): The ideas to deduplicate.
+
+    Returns:
+        list: The first occurrence of each idea, in the original order.
+    """
+    seen = set()
+    unique_ideas = []
+    for idea in ideas:
+        key = " ".join(idea.split()).casefold()
+        if key not in seen:
+            seen.add(key)
+            unique_ideas.append(idea)
+    return unique_ideas
+
+def embed_texts(texts: list) -> list:
+    """
+    Embed texts with the OpenAI embeddings API.
+
+    Args:
+        texts (list): The texts to embed.
+
+    Returns:
+        list: The embeddings, in the same order as the texts.
+    """
+    response = openai_client.embeddings.create(model=embedding_model, input=texts)
+    return [item.embedding for item in response.data]
+
+def normalize_embeddings(embeddings) -> np.ndarray:
+    """
+    Scale embeddings to unit length, so cosine similarity is a plain dot product.
+
+    Args:
+        embeddings: One embedding or a matrix with one embedding per row.
+
+    Returns:
+        np.ndarray: The normalized float32 embeddings.
+    """
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    return embeddings / np.linalg.norm(embeddings, axis=-1, keepdims=True)
+
+def quantize_embeddings(embeddings: np.ndarray) -> tuple:
+    """
+    Quantize normalized embeddings for the semantic cache.
+
+    Args:
+        embeddings (np.ndarray): Normalized embeddings, one per row.
+
+    Returns:
+        tuple: The int8 codes, the float32 per-row scales that turn codes back into
+            embeddings, and the sign bits packed into uint64 words for the Hamming pre-filter.
+    """
+    scales = np.abs(embeddings).max(axis=1) / 127
+    codes = np.round(embeddings / scales[:, np.newaxis]).astype(np.int8)
+    return codes, scales.astype(np.float32), pack_signs(embeddings)
+
+def pack_signs(embeddings: np.ndarray) -> np.ndarray:
+    """
+    Pack the sign bits of embeddings into uint64 words.
+
+    Args:
+        embeddings (np.ndarray): One embedding or a matrix with one embedding per row.
+
+    Returns:
+        np.ndarray: The packed sign bits, 24 words per 1536-dimensional embedding.
+    """
+    return np.packbits(embeddings > 0, axis=-1).view(np.uint64)
+
+class SemanticCache:
+    """
+    Persist LLM responses in SQLite keyed by prompt embedding, so prompts that are
+    near-duplicates of earlier ones reuse the earlier response.
+
+    Embeddings are also kept in memory per namespace as int8 codes plus packed sign
+    bits. A lookup ranks entries by Hamming distance between sign bits, then scores
+    the closest SEMANTIC_CACHE_CANDIDATES exactly against the dequantized codes.
+
+    Args:
+        path (str): The SQLite database file.
+        threshold (float): The minimum cosine similarity for a cache hit.
+    """
+
+    def __init__(self, path: str, threshold: float):
+        self.threshold = threshold
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        with self.conn:
+            self.conn.execute("CREATE TABLE IF NOT EXISTS llm_cache (namespace TEXT, prompt TEXT, embedding BLOB, response TEXT)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS llm_cache_namespace ON llm_cache (namespace)")
+
+        rows_by_namespace = {}
+        for namespace, embedding, response in self.conn.execute("SELECT namespace, embedding, response FROM llm_cache"):
+            rows_by_namespace.setdefault(namespace, []).append((np.frombuffer(embedding, dtype=np.float32), response))
+        self.entries = {}
+        for namespace, rows in rows_by_namespace.items():
+            embeddings = normalize_embeddings(np.stack([embedding for embedding, _ in rows]))
+            self.entries[namespace] = (*quantize_embeddings(embeddings), [response for _, response in rows])
+
+    def lookup(self, namespace: str, embedding: list):
+        with self.lock:
+            entries = self.entries.get(namespace)
+        if entries is None:
+            return None
+        codes, scales, signs, responses = entries
+        query = normalize_embeddings(embedding)
+
+        candidates = np.arange(len(responses))
+        if len(responses) > SEMANTIC_CACHE_CANDIDATES:
+            distances = np.bitwise_count(signs ^ pack_signs(query)).sum(axis=1, dtype=np.uint32)
+            candidates = np.argpartition(distances, SEMANTIC_CACHE_CANDIDATES)[:SEMANTIC_CACHE_CANDIDATES]
+
+        sims = (codes[candidates] @ query) * scales[candidates]
+        best = int(sims.argmax())
+        if sims[best] < self.threshold:
+            return None
+        return json.loads(responses[candidates[best]])
+
+    def insert(self, namespace: str, prompt: str, embedding: list, response) -> None:
+        embedding = np.asarray(embedding, dtype=np.float32)
+        response = json.dumps(response)
+        row = quantize_embeddings(normalize_embeddings(embedding)[np.newaxis])
+        with self.lock:
+            with self.conn:
+                self.conn.execute("INSERT INTO llm_cache VALUES (?, ?, ?, ?)", (namespace, prompt, embedding.tobytes(), response))
+            entries = self.entries.get(namespace)
+            if entries is None:
+                self.entries[namespace] = (*row, [response])
+            else:
+                codes, scales, signs, responses = entries
+                self.entries[namespace] = (
+                    np.concatenate([codes, row[0]]),
+                    np.concatenate([scales, row[1]]),
+                    np.concatenate([signs, row[2]]),
+                    responses + [response],
+                )
+
+@st.cache_resource
+def get_semantic_cache() -> SemanticCache:
+    return SemanticCache(SEMANTIC_CACHE_PATH, SEMANTIC_CACHE_THRESHOLD)
+
+def run_with_semantic_cache(namespace: str, prompts: list, generate) -> list:
+    """
+    Reuse cached responses for prompts similar to earlier ones and generate the rest.
+
+    Args:
+        namespace (str): The cache partition, e.g. the pipeline stage and model.
+        prompts (list): The prompts to answer.
+        generate: A callable taking the uncached prompts and a save callback, and returning
+            exactly one response per prompt, in order. Calling save(position, response) as
+            each response arrives caches it even if a later one fails.
+
+    Returns:
+        list: The responses, in the same order as the prompts.
+    """
+    cache = get_semantic_cache()
+    try:
+        embeddings = embed_texts(prompts)
+    except Exception as e:
+        logging.warning(f"Semantic cache disabled for this run: {str(e)}")
+        return generate(prompts, lambda position, response: None)
+
+    responses = [cache.lookup(namespace, embedding) for embedding in embeddings]
+    missed = [i for i, response in enumerate(responses) if response is None]
+    if missed:
+        def save(position, response):
+            cache.insert(namespace, prompts[missed[position]], embeddings[missed[position]], response)
+        
+        new_responses = generate([prompts[i] for i in missed], save)
+        # A response filed under the wrong prompt would be served to every later session
+        if len(new_responses) != len(missed):
+            raise ValueError(f"Expected {len(missed)} responses, got {len(new_responses)}")
+        for i, response in zip(missed, new_responses):
+            responses[i] = response
+    return responses
+
+class RateLimiter:
+    """
+    Limit concurrent Claude requests with a semaphore and a tokens-per-minute bucket.
+
+    Args:
+        max_concurrency (int): The maximum number of requests in flight.
+        tokens_per_minute (int): The token budget refilled every minute.
+    """
+
+    def __init__(self, max_concurrency: int = LLM_MAX_CONCURRENCY, tokens_per_minute: int = LLM_TOKENS_PER_MINUTE):
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.tokens_per_minute = tokens_per_minute
+        self.available_tokens = tokens_per_minute
+        self.last_refill = time.monotonic()
+        self.bucket_lock = asyncio.Lock()
+
+    async def wait_for_tokens(self, cost: int) -> None:
+        cost = min(cost, self.tokens_per_minute)
+        async with self.bucket_lock:
+            while True:
+                now = time.monotonic()
+                refill = (now - self.last_refill) * self.tokens_per_minute / 60
+                self.available_tokens = min(self.tokens_per_minute, self.available_tokens + refill)
+                self.last_refill = now
+                if self.available_tokens >= cost:
+                    self.available_tokens -= cost
+                    return
+                await asyncio.sleep((cost - self.available_tokens) * 60 / self.tokens_per_minute)
+
+def anthropic_client() -> anthropic.AsyncAnthropic:
+    """
+    Create the async Anthropic client shared by a fan-out run.
+
+    The SDK's own retries are disabled, since call_claude retries every request.
+
+    Returns:
+        anthropic.AsyncAnthropic: The client.
+    """
+    return anthropic.AsyncAnthropic(api_key=ANTHROPIC_API_KEY, max_retries=0)
+
+def is_retryable(error: Exception) -> bool:
+    """
+    Tell whether a failed Claude request is worth retrying.
+
+    Connection errors, rate limits (429), overloads (529), and server errors (5xx) are
+    retried, as are overloaded or server error events sent in the middle of a stream,
+    which arrive on a 200 response. Other client errors are not.
+
+    Args:
+        error (Exception): The error raised by the request.
+
+    Returns:
+        bool: Whether to retry the request.
+    """
+    if isinstance(error, anthropic.APIConnectionError):
+        return True
+    if not isinstance(error, anthropic.APIStatusError):
+        return False
+    body = error.body if isinstance(error.body, dict) else {}
+    error_type = (body.get("error") or {}).get("type")
+    return error.status_code in (429, 529) or error.status_code >= 500 or error_type in ("rate_limit_error", "overloaded_error", "api_error")
+
+@backoff.on_exception(
+    backoff.expo,
+    (anthropic.APIConnectionError, anthropic.APIStatusError),
+    max_tries=5,
+    jitter=backoff.full_jitter,
+    giveup=lambda error: not is_retryable(error),
+)
+async def call_claude(client, limiter, on_update=None, **kwargs):
+    """
+    Stream a Claude message through the rate limiter, retrying the failures accepted
+    by is_retryable with exponential backoff.
+
+    Args:
+        client (anthropic.AsyncAnthropic): The client to send the request with.
+        limiter (RateLimiter): The limiter shared by the fan-out run.
+        on_update: An optional callback for the message received so far, called at most
+            once every PREVIEW_INTERVAL seconds.
+        **kwargs: The arguments for client.messages.stream.
+
+    Returns:
+        anthropic.types.Message: The final message.
+    """
+    prompt = kwargs.get("system", "") + "".join(message["content"] for message in kwargs["messages"])
+    await limiter.wait_for_tokens(len(prompt) // 4)
+    async with limiter.semaphore:
+        async with client.messages.stream(**kwargs) as stream:
+            last_update = 0.0
+            async for _ in stream:
+                if on_update and time.monotonic() - last_update >= PREVIEW_INTERVAL:
+                    on_update(stream.current_message_snapshot)
+                    last_update = time.monotonic()
+            return await stream.get_final_message()
+
+async def gather_with_progress(coros, progress_bar) -> list:
+    """
+    Run coroutines concurrently, advancing the progress bar as each one finishes.
+
+    Args:
+        coros (list): The coroutines to run.
+        progress_bar: The Streamlit progress bar to update.
+
+    Returns:
+        list: The results, in the same order as the coroutines.
+    """
+    tasks = [asyncio.ensure_future(coro) for coro in coros]
+    for i, task in enumerate(asyncio.as_completed(tasks)):
+        await task
+        progress_bar.progress((i + 1) / len(tasks))
+    return await asyncio.gather(*tasks)
+
+# Generated idea lists are hashed by the digest stored next to them in session_state
+@st.cache_data(hash_funcs={list: lambda _: st.session_state.get("generated_ideas_digest", "")})
+def evaluate_ideas(generated_ideas: list, num_ideas: int, model: str, _ui_context: contextvars.Context) -> list:
     try:
         system_prompt = "You are an expert editor at a major news publication. Your task is to select the most newsworthy and interesting story ideas from a list of brainstormed ideas. For your selection, propose an optimized title, description, justification, specific step by step methodology, and names with links if possible to required datasets/sources."
         
-        def get_idea_summary(idea):
-            prompt = f"""Here is a brainstormed idea:
-            {idea}
-            Please provide concrete details for your chosen idea in the following format:
+        async def get_idea_summaries(client, limiter, ideas, preview):
+            numbered_ideas = "\n".join(f"Idea {i}: {idea}" for i, idea in enumerate(ideas, start=1))
+            prompt = f"""Here are {len(ideas)} brainstormed ideas:
+            {numbered_ideas}
+            For each idea, in the same order, please provide concrete details in the following format:
             Title: [Enhanced title for the idea]
             Description: [Detailed description of the idea, including the lede, newsworthy hooks, target audience, and why they should care]
             Justification: [Justification for selecting this idea]
             Methodology: [Methodology for producing this idea, including feasibility within a 2-week timeline]
-            Datasets/Sources: [Datasets, sources, technologies, and tools needed to accomplish this idea]"""
-            response = anthropic.Anthropic(api_key=ANTHROPIC_API_KEY).messages.create(
+            Datasets/Sources: [Datasets, sources, technologies, and tools needed to accomplish this idea]
+            Start each idea with a line containing only its number, e.g. "Idea 1", followed by "Title:", and separate the ideas with a line containing only ==="""
+            def show_text(message):
+                if message.content:
+                    preview.markdown(message.content[0].text)
+            
+            response = await call_claude(
+                client,
+                limiter,
+                on_update=show_text,
                 system=system_prompt,
                 model=model,
                 messages=[{"role": "user", "content": prompt}],
-                max_tokens=2000,
+                max_tokens=4096,
             )
-            return response.content[0].text
+            preview.empty()
+            summaries = parse_idea_summaries(response.content[0].text, len(ideas))
+            if summaries and (response.stop_reason != "max_tokens" or len(ideas) == 1):
+                return summaries
+            if len(ideas) == 1:
+                raise ValueError(f"Claude did not return a summary for the idea: {ideas[0][:100]}")
+            # Split a truncated or malformed batch, so each half gets the whole token budget
+            middle = len(ideas) // 2
+            return await get_idea_summaries(client, limiter, ideas[:middle], preview) + await get_idea_summaries(client, limiter, ideas[middle:], preview)
         
-        idea_summaries = []
-        progress_bar = st.progress(0)
+        async def summarize_batch(client, limiter, ideas, offset, preview, save):
+            summaries = await get_idea_summaries(client, limiter, ideas, preview)
+            for i, summary in enumerate(summaries):
+                save(offset + i, summary)
+            return summaries
         
-        with ThreadPoolExecutor(max_workers=14) as executor:
-            futures = []
-            for idea in generated_ideas[:num_ideas]:
-                future = executor.submit(get_idea_summary, idea)
-                futures.append(future)
-            
-            for i, future in enumerate(as_completed(futures)):
-                idea_summary = future.result()
-                idea_summaries.append(idea_summary)
-                progress = (i + 1) / len(futures)
-                progress_bar.progress(progress)
+        async def summarize_ideas(ideas, save):
+            progress_bar = st.progress(0)
+            limiter = RateLimiter()
+            offsets = range(0, len(ideas), IDEA_BATCH_SIZE)
+            previews = [st.empty() for _ in offsets]
+            async with anthropic_client() as client:
+                batch_summaries = await gather_with_progress([summarize_batch(client, limiter, ideas[offset:offset + IDEA_BATCH_SIZE], offset, preview, save) for offset, preview in zip(offsets, previews)], progress_bar)
+            return [summary for summaries in batch_summaries for summary in summaries]
+        
+        # Progress and previews are drawn in the caller's context, outside st.cache_data's
+        # element recording, so they are not replayed on every cache hit
+        idea_summaries = run_with_semantic_cache(
+            f"summary:{model}",
+            dedupe_ideas(generated_ideas)[:num_ideas],
+            lambda ideas, save: _ui_context.run(asyncio.run, summarize_ideas(ideas, save)),
+        )
         
         return idea_summaries[:num_ideas]
     except anthropic.APIError as e:
@@ -205,74 +573,66 @@ def evaluate_ideas(generated_ideas: list, num_ideas: int, model: str) -> list:
 
 
 
-@st.cache_data
-def fix_json_with_gpt(json_str, expected_format):
-    response = openai.chat.completions.create(
-        model="gpt-4-turbo",
-        messages=[
-            {
-                "role": "system",
-                "content": "You are an expert at fixing JSON strings to match the expected format."
-            },
-            {
-                "role": "user",
-                "content": f"Fix the following JSON string to match the expected format:\n\nExpected format:\n{expected_format}\n\nJSON string to fix:\n{json_str}"
-            }
-        ],
-        max_tokens=4000,
-        n=1,
-        stop=None,
-        temperature=0.2,
-        response_format={"type": "json_object"}
-    )
-    fixed_json = response.choices[0].message.content.strip()
-    print(fixed_json)
-    return fixed_json
+def format_brief(brief: dict) -> str:
+    """
+    Format a possibly partial idea brief as Markdown.
 
-@st.cache_data
-def generate_idea_brief(idea, model):
+    Args:
+        brief (dict): The brief fields received so far.
+
+    Returns:
+        str: The Markdown for the fields present in the brief.
+    """
+    sections = [f"### {brief['title']}"] if brief.get("title") else []
+    for key, label in [("description", "Description"), ("justification", "Justification"), ("methodology", "Methodology"), ("datasets_sources", "Datasets/Sources")]:
+        if brief.get(key):
+            sections.append(f"**{label}:** {brief[key]}")
+    return "\n\n".join(sections)
+
+async def generate_idea_brief(client, limiter, idea, model, preview):
     prompt = f"""Enhance and make more specific each part of the brief, especially providing sources for datasets needed for the idea and methodological guidance to help prevent roadblocks or timesucks.
     
     Idea: {idea}"""
     
-    response = anthropic.Anthropic(api_key=ANTHROPIC_API_KEY).messages.create(
+    def show_brief(message):
+        if message.content:
+            preview.markdown(format_brief(message.content[0].input))
+    
+    response = await call_claude(
+        client,
+        limiter,
+        on_update=show_brief,
         model=model,
         messages=[{"role": "user", "content": prompt}],
         max_tokens=4000,
+        tools=[BRIEF_TOOL],
+        tool_choice={"type": "tool", "name": BRIEF_TOOL["name"]},
     )
-    content = response.content[0].text
-    
-    expected_format = """
-    {
-        "title": "Enhanced title for the idea",
-        "description": "Detailed description of the idea, including the lede, newsworthy hooks, target audience, and why they should care",
-        "justification": "Justification for selecting this idea",
-        "methodology": "Methodology for producing this idea, including feasibility within a 2-week timeline",
-        "datasets_sources": "Datasets, sources, technologies, and tools needed to accomplish this idea"
-    }
-    """
-    
-    fixed_json = fix_json_with_gpt(content, expected_format)
-    idea_brief = json.loads(fixed_json)
+    preview.empty()
+    idea_brief = Brief.model_validate(response.content[0].input).model_dump()
     return idea_brief
 
 @st.cache_data
-def generate_briefs(selected_ideas: list, model: str) -> list:
+def generate_briefs(selected_ideas: list, model: str, _ui_context: contextvars.Context) -> list:
     try:
-        idea_briefs = []
-        progress_bar = st.progress(0)
+        async def brief_idea(client, limiter, idea, position, preview, save):
+            brief = await generate_idea_brief(client, limiter, idea, model, preview)
+            save(position, brief)
+            return brief
         
-        with ThreadPoolExecutor(max_workers=12) as executor:
-            futures = []
-            for idea in selected_ideas:
-                future = executor.submit(generate_idea_brief, idea, model)
-                futures.append(future)
-            
-            for i, future in enumerate(as_completed(futures)):
-                idea_brief = future.result()
-                idea_briefs.append(idea_brief)
-                progress = (i + 1) / len(futures)
-                progress_bar.progress(progress)
+        async def brief_ideas(ideas, save):
+            progress_bar = st.progress(0)
+            limiter = RateLimiter()
+            previews = [st.empty() for _ in ideas]
+            async with anthropic_client() as client:
+                return await gather_with_progress([brief_idea(client, limiter, idea, i, preview, save) for i, (idea, preview) in enumerate(zip(ideas, previews))], progress_bar)
+        
+        # Progress and previews are drawn in the caller's context, as in evaluate_ideas
+        idea_briefs = run_with_semantic_cache(
+            f"brief:{model}",
+            selected_ideas,
+            lambda ideas, save: _ui_context.run(asyncio.run, brief_ideas(ideas, save)),
+        )
         
         return idea_briefs
     except anthropic.APIError as e:
@@ -284,6 +644,38 @@ def generate_briefs(selected_ideas: list, model: str) -> list:
 
 
 
+@st.cache_resource
+def get_pdf_styles() -> tuple:
+    """
+    Build the ReportLab paragraph styles for exported idea briefs.
+
+    Returns:
+        tuple: The title, section, and body paragraph styles.
+    """
+    styles = getSampleStyleSheet()
+    title_style = ParagraphStyle(
+        'TitleStyle',
+        parent=styles['Heading1'],
+        alignment=TA_CENTER,
+        textColor=HexColor('#1f77b4'),
+        spaceBefore=12,
+        spaceAfter=6,
+    )
+    section_style = ParagraphStyle(
+        'SectionStyle',
+        parent=styles['Heading2'],
+        textColor=HexColor('#ff7f0e'),
+        spaceBefore=12,
+        spaceAfter=6,
+    )
+    body_style = ParagraphStyle(
+        'BodyStyle',
+        parent=styles['BodyText'],
+        spaceBefore=6,
+        spaceAfter=6,
+    )
+    return title_style, section_style, body_style
+
 def export_briefs(idea_briefs: list) -> None:
     """
     Export idea briefs to a PDF document.
@@ -291,57 +683,29 @@ def export_briefs(idea_briefs: list) -> None:
         idea_briefs (list): The list of idea briefs to export.
     """
     try:
-        import tempfile
-        from reportlab.lib.pagesizes import letter
-        from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
-        from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-        from reportlab.lib.enums import TA_CENTER
-        from reportlab.lib.colors import HexColor
-
-        styles = getSampleStyleSheet()
-        title_style = ParagraphStyle(
-            'TitleStyle',
-            parent=styles['Heading1'],
-            alignment=TA_CENTER,
-            textColor=HexColor('#1f77b4'),
-            spaceBefore=12,
-            spaceAfter=6,
-        )
-        section_style = ParagraphStyle(
-            'SectionStyle',
-            parent=styles['Heading2'],
-            textColor=HexColor('#ff7f0e'),
-            spaceBefore=12,
-            spaceAfter=6,
+        title_style, section_style, body_style = get_pdf_styles()
+
+        pdf_buffer = io.BytesIO()
+        doc = SimpleDocTemplate(pdf_buffer, pagesize=letter)
+        elements = []
+        for brief in idea_briefs:
+            elements.append(Paragraph(brief["title"], title_style))
+            elements.append(Paragraph("Description", section_style))
+            elements.append(Paragraph(brief["description"], body_style))
+            elements.append(Paragraph("Justification", section_style))
+            elements.append(Paragraph(brief["justification"], body_style))
+            elements.append(Paragraph("Methodology", section_style))
+            elements.append(Paragraph(brief["methodology"], body_style))
+            elements.append(Paragraph("Datasets/Sources", section_style))
+            elements.append(Paragraph(brief["datasets_sources"], body_style))
+            elements.append(Spacer(1, 24))
+        doc.build(elements)
+        st.download_button(
+            label="Download Idea Briefs",
+            data=pdf_buffer.getvalue(),
+            file_name="idea_briefs.pdf",
+            mime="application/pdf",
         )
-        body_style = ParagraphStyle(
-            'BodyStyle',
-            parent=styles['BodyText'],
-            spaceBefore=6,
-            spaceAfter=6,
-        )
-
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp_file:
-            doc = SimpleDocTemplate(tmp_file.name, pagesize=letter)
-            elements = []
-            for brief in idea_briefs:
-                elements.append(Paragraph(brief["title"], title_style))
-                elements.append(Paragraph("Description", section_style))
-                elements.append(Paragraph(brief["description"], body_style))
-                elements.append(Paragraph("Justification", section_style))
-                elements.append(Paragraph(brief["justification"], body_style))
-                elements.append(Paragraph("Methodology", section_style))
-                elements.append(Paragraph(brief["methodology"], body_style))
-                elements.append(Paragraph("Datasets/Sources", section_style))
-                elements.append(Paragraph(brief["datasets_sources"], body_style))
-                elements.append(Spacer(1, 24))
-            doc.build(elements)
-            st.download_button(
-                label="Download Idea Briefs",
-                data=tmp_file.read(),
-                file_name="idea_briefs.pdf",
-                mime="application/pdf",
-            )
     except Exception as e:
         st.error(f"Error exporting idea briefs: {str(e)}")
 
@@ -361,17 +725,15 @@ with tab1:
             st.warning("Please enter a topic.")
         else:
             try:
-                progress_text = "Generating ideas..."
-                my_bar = st.progress(0, text=progress_text)
-                
-                generated_ideas = get_ideas(topic, num_ideas, temperature, gpt_model)
+                with st.spinner("Generating ideas..."):
+                    generated_ideas = get_ideas(topic, num_ideas, temperature, gpt_model)
                 
                 st.session_state.generated_ideas = generated_ideas
+                st.session_state.generated_ideas_digest = hashlib.blake2b("\0".join(generated_ideas).encode(), digest_size=16).hexdigest()
                 st.write("Generated Ideas:")
                 
-                ideas_df = pd.DataFrame(generated_ideas, columns=["Ideas"])
                 with st.expander("View Generated Ideas", expanded=True):
-                    st.table(ideas_df)  # Display ideas without index column
+                    st.dataframe({"Ideas": generated_ideas}, use_container_width=True, hide_index=True)  # Display ideas without index column
             except Exception as e:
                 st.error(f"An error occurred during idea generation for topic '{topic}' with {num_ideas} ideas: {str(e)}")
 
@@ -382,9 +744,8 @@ with tab2:
     else:
         st.write("Fractl Finetuned Model's Brainstorming Ideas:")
         
-        ideas_df = pd.DataFrame(st.session_state.generated_ideas, columns=["Generated Ideas"])
         with st.expander("View Generated Ideas", expanded=True):
-            st.dataframe(ideas_df, use_container_width=True,  hide_index=True)  # Display ideas without index column
+            st.dataframe({"Generated Ideas": st.session_state.generated_ideas}, use_container_width=True,  hide_index=True)  # Display ideas without index column
         
         claude_models = ["claude-3-opus-20240229", "claude-3-sonnet-20240229", "claude-3-haiku-20240307"]
         selected_model = st.selectbox("Select Claude Model", options=claude_models, index=1)
@@ -392,12 +753,12 @@ with tab2:
         evaluate_button = st.button("Evaluate and Refine Ideas")
         if evaluate_button:
             with st.spinner("Evaluating and refining ideas..."):
-                refined_ideas = evaluate_ideas(st.session_state.generated_ideas, num_ideas, selected_model)
+                refined_ideas = evaluate_ideas(st.session_state.generated_ideas, num_ideas, selected_model, contextvars.copy_context())
             st.session_state.refined_ideas = refined_ideas
+            st.session_state.refined_titles = [idea.split("\n", 1)[0].removeprefix("Title:").strip() for idea in refined_ideas]
             st.write("Refined Ideas:")
             
-            refined_ideas_df = pd.DataFrame({'Refined Idea': refined_ideas})
-            st.dataframe(refined_ideas_df, use_container_width=True,  hide_index=True)  # Display refined ideas without index column
+            st.dataframe({'Refined Idea': refined_ideas}, use_container_width=True,  hide_index=True)  # Display refined ideas without index column
 with tab3:
     st.subheader("Idea Selection")
     if not st.session_state.get("refined_ideas"):
@@ -405,8 +766,7 @@ with tab3:
     else:
         st.write("Refined Ideas:")
         
-        refined_ideas_df = pd.DataFrame({'Refined Ideas': st.session_state.refined_ideas})
-        refined_ideas_titles = refined_ideas_df['Refined Ideas'].apply(lambda x: x.split("\n")[0].replace("Title: ", ""))
+        refined_ideas_titles = st.session_state.refined_titles
         
         selected_titles = st.multiselect("Select ideas for brief generation", options=refined_ideas_titles)
         brief_button = st.button("Generate Idea Briefs")
@@ -417,7 +777,7 @@ with tab3:
             else:
                 selected_idea_blocks = [idea for title, idea in zip(refined_ideas_titles, st.session_state.refined_ideas) if title in selected_titles]
                 with st.spinner("Generating idea briefs..."):
-                    idea_briefs = generate_briefs(selected_idea_blocks, selected_model)
+                    idea_briefs = generate_briefs(selected_idea_blocks, selected_model, contextvars.copy_context())
                 st.session_state.idea_briefs = idea_briefs
                 st.write("Idea Briefs:")
                 for brief in idea_briefs:
@@ -428,6 +788,8 @@ with tab4:
     if not st.session_state.get("idea_briefs"):
         st.warning("Please generate idea briefs first.")
     else:
+        import pandas as pd
+
         idea_briefs_df = pd.DataFrame.from_records(st.session_state.idea_briefs)
         st.dataframe(idea_briefs_df[['title', 'description', 'methodology']], use_container_width=True,  hide_index=True)  # Display idea briefs without index column
         
@@ -0,0 +1,36 @@
+import re
+
+# Labels of the summary format, optionally wrapped in markdown bold by Claude
+SUMMARY_LABELS = re.compile(r"\*\*[ \t]*(Idea \d+|Title|Description|Justification|Methodology|Datasets/Sources)[ \t]*:?[ \t]*\*\*(?:[ \t]*:)?")
+
+# An "Idea N" line, anywhere in a block, followed by the summary starting at "Title:"
+IDEA_HEADER = re.compile(r"^\W*Idea (\d+)\W*$\W*(Title:.*)", re.MULTILINE | re.DOTALL)
+
+
+def parse_idea_summaries(text: str, num_ideas: int) -> list:
+    """
+    Split a batched Claude response into one summary per idea.
+
+    Blocks are separated by "===" lines and matched to ideas by their "Idea N" line, so
+    a preamble before the first idea is ignored and the output follows the numbering.
+    A response for a single idea is accepted from its first "Title:" even without an
+    "Idea 1" line.
+
+    Args:
+        text (str): The response text.
+        num_ideas (int): The number of ideas in the batch.
+
+    Returns:
+        list: The summaries ordered by idea number, or None if any idea is missing.
+    """
+    text = SUMMARY_LABELS.sub(lambda match: f"{match.group(1)}:", text)
+    summaries = {}
+    for block in text.split("==="):
+        match = IDEA_HEADER.search(block)
+        if match:
+            summaries[int(match.group(1))] = match.group(2).strip()
+    if sorted(summaries) == list(range(1, num_ideas + 1)):
+        return [summaries[i] for i in range(1, num_ideas + 1)]
+    if num_ideas == 1 and "Title:" in text:
+        return [text[text.index("Title:"):].split("===")[0].strip()]
+    return None
@@ -0,0 +1,23 @@
+from idea_parsing import parse_idea_summaries
+
+
+def test_preamble_before_first_idea():
+    text = "Here are the details for each idea:\n\nIdea 1\nTitle: A\nDescription: a\n===\nIdea 2\nTitle: B\n===\nIdea 3\nTitle: C"
+    assert parse_idea_summaries(text, 3) == ["Title: A\nDescription: a", "Title: B", "Title: C"]
+
+
+def test_single_idea_without_header():
+    assert parse_idea_summaries("Here is the summary:\n\nTitle: A\nDescription: a", 1) == ["Title: A\nDescription: a"]
+
+
+def test_bold_labels():
+    text = "**Idea 1**\n**Title:** A\n**Description**: a\n===\n**Idea 2:**\n**Title:** B"
+    assert parse_idea_summaries(text, 2) == ["Title: A\nDescription: a", "Title: B"]
+
+
+def test_ideas_out_of_order():
+    assert parse_idea_summaries("Idea 2\nTitle: B\n===\nIdea 1\nTitle: A", 2) == ["Title: A", "Title: B"]
+
+
+def test_missing_idea():
+    assert parse_idea_summaries("Idea 1\nTitle: A\n===\nIdea 3\nTitle: C", 3) is None